@@ -0,0 +1,23 @@
+"""Least squares line fit over a prefix of the data, compiled with numba."""
+
+from numba import njit
+
+
+# explicit signature, so it is compiled (or loaded from the on disk cache) at import
+@njit('UniTuple(f8, 2)(i8[:], f8[:], i8)', cache=True)
+def ols_prefix(x, y, k):
+    """Fit a least squares line through the first k points. Return slope m and intercept c."""
+    sx = sy = sxx = sxy = 0.0
+    for i in range(k):
+        xi = x[i]
+        yi = y[i]
+        sx += xi
+        sy += yi
+        sxx += xi * xi
+        sxy += xi * yi
+
+    d = k * sxx - sx * sx
+    if d == 0:
+        return 0.0, sy / k
+    m = (k * sxy - sx * sy) / d
+    return m, (sy - m * sx) / k
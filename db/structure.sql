@@ -30,6 +30,8 @@ CREATE TABLE user (
   password varchar(100) DEFAULT NULL,
   rmc_value varchar(255) DEFAULT NULL,
   rmc_expiry datetime DEFAULT NULL,
+  etag varchar(255) DEFAULT NULL,
+  last_modified varchar(100) DEFAULT NULL,
   firstname varchar(100) NOT NULL,
   lastname varchar(100) NOT NULL,
   goal_date date NOT NULL,
@@ -2,24 +2,37 @@
 
 """Scrape queue positions off rwth Studierendenwerk, save to db, Graph."""
 
+from __future__ import annotations  # np annotations without importing numpy
 import MySQLdb as sql
+import MySQLdb.cursors
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import lxml.html
 from urllib.parse import urljoin
 import datetime as dt
 import argparse
-import numpy as np
 import os
 import sys
 from collections import namedtuple
+from itertools import groupby
 from dataclasses import dataclass
 from dotenv import dotenv_values
-import bisect
 import re
 
 dirname = os.path.realpath(os.path.dirname(__file__))
 config = dotenv_values(dirname + "/.env")
 
+# one session for all users, so connections to the site are pooled and reused
+SESSION = requests.Session()
+SESSION.headers['User-Agent'] = ('Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:120.0) '
+                                 'Gecko/20100101 Firefox/120.0')
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                      max_retries=Retry(total=2, backoff_factor=0.3)))
+
+# only needed for --graph and slow, so imported by import_graph_modules()
+np = plt = matplotlib = pandas = ols_prefix = None
+
 
 @dataclass
 class RoomRecord:
@@ -43,6 +56,8 @@ class User:
     password: str
     rmc_value: str  # remember_me_cookie
     rmc_expiry: dt.datetime
+    etag: str | None  # of the last dashboard page scraped
+    last_modified: str | None  # ditto
     firstname: str
     lastname: str
     goal_date: dt.date
@@ -59,53 +74,84 @@ class Regression:
     deta_1w: int
 
 
-def login_and_get_rows(db, user: User):
-    """Login to RWTH site and retrieve room queue table page."""
-    with requests.sessions.Session() as sess:
-        sess.headers.update({'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:120.0) '
-                             'Gecko/20100101 Firefox/120.0'})
-        if user.rmc_value is None or user.rmc_expiry <= dt.datetime.now():
-            # we don't have a valid "remember me cookie" so must login from scatch
-            req = sess.get(config['login_url']).text
-            html = BeautifulSoup(req, "html.parser")
-
-            token = html.find("input", {"name": "_csrf_token"}).attrs["value"]
-
-            payload = {
-                "_csrf_token": token,
-                "_username": user.email,
-                "_password": user.password,
-                "_remember_me": 'on',
-            }
-            action_url = urljoin(config['login_url'],
-                                 html.find("form").attrs["action"])
-            sess.post(action_url, data=payload)
-            rmc_cookie = next(c for c in sess.cookies if c.name == 'REMEMBERME')
-            user.rmc_value = rmc_cookie.value
-            user.rmc_expiry = dt.datetime.fromtimestamp(rmc_cookie.expires)
-            with db.cursor() as cur:
-                cur.execute(
-                    "update user set rmc_value = %s, rmc_expiry = %s "
-                    "where id = %s",
-                    (user.rmc_value, user.rmc_expiry, user.id))
-                db.commit()
-        else:
-            # use the existing "remember me cookie" from the db
-            # this is faster and more secure as it doesn't rely on pw which we shouldn't have
-            optional_args = {
-                'domain': config['domain'],
-                'path': '/',
-                'secure': True,
-                'expires': user.rmc_expiry.timestamp(),
-                'rest': {'HttpOnly': True}
-            }
-            rmc_cookie = requests.cookies.create_cookie(
-                'REMEMBERME', user.rmc_value, **optional_args)
-            sess.cookies.set_cookie(rmc_cookie)
-
-        r = sess.get(config['dashboard_url'])
-        soup = BeautifulSoup(r.content, "html.parser")
-        return soup.find("div", id="rooms").find("table").find('tbody').find_all('tr')
+def html_parser(r: requests.Response):
+    """Make an lxml HTML parser for a response.
+
+    Only passes on an encoding if the Content-Type header names a charset. requests otherwise
+    reports ISO-8859-1 for text/html, which would override the page's own <meta charset>.
+    """
+    if 'charset=' in r.headers.get('Content-Type', '').lower():
+        return lxml.html.HTMLParser(encoding=r.encoding)
+    return lxml.html.HTMLParser()
+
+
+def login_and_get_rows(db, user: User, sess: requests.Session = SESSION):
+    """Login to RWTH site and retrieve room queue table page.
+
+    Returns None if the page hasn't changed since the last scrape.
+    """
+    sess.cookies.clear()  # don't leak the previous user's cookies
+    if user.rmc_value is None or user.rmc_expiry <= dt.datetime.now():
+        # we don't have a valid "remember me cookie" so must login from scatch
+        r = sess.get(config['login_url'])
+        html = lxml.html.fromstring(r.content, parser=html_parser(r))
+
+        token = html.find(".//input[@name='_csrf_token']").get("value")
+
+        payload = {
+            "_csrf_token": token,
+            "_username": user.email,
+            "_password": user.password,
+            "_remember_me": 'on',
+        }
+        action_url = urljoin(config['login_url'],
+                             html.find(".//form").get("action"))
+        sess.post(action_url, data=payload)
+        rmc_cookie = next(c for c in sess.cookies if c.name == 'REMEMBERME')
+        user.rmc_value = rmc_cookie.value
+        user.rmc_expiry = dt.datetime.fromtimestamp(rmc_cookie.expires)
+        with db.cursor() as cur:
+            cur.execute(
+                "update user set rmc_value = %s, rmc_expiry = %s "
+                "where id = %s",
+                (user.rmc_value, user.rmc_expiry, user.id))
+            db.commit()
+    else:
+        # use the existing "remember me cookie" from the db
+        # this is faster and more secure as it doesn't rely on pw which we shouldn't have
+        optional_args = {
+            'domain': config['domain'],
+            'path': '/',
+            'secure': True,
+            'expires': user.rmc_expiry.timestamp(),
+            'rest': {'HttpOnly': True}
+        }
+        rmc_cookie = requests.cookies.create_cookie(
+            'REMEMBERME', user.rmc_value, **optional_args)
+        sess.cookies.set_cookie(rmc_cookie)
+
+    # conditional request: server replies 304, without a body, if nothing has changed
+    headers = {}
+    if user.etag is not None:
+        headers['If-None-Match'] = user.etag
+    if user.last_modified is not None:
+        headers['If-Modified-Since'] = user.last_modified
+
+    # parse incrementally while the page downloads
+    with sess.get(config['dashboard_url'], headers=headers, stream=True) as r:
+        if r.status_code == 304:
+            return None
+        parser = html_parser(r)
+        for chunk in r.iter_content(8192):
+            parser.feed(chunk)
+        user.etag = r.headers.get('ETag')
+        user.last_modified = r.headers.get('Last-Modified')
+    html = parser.close()
+    rooms = html.find(".//div[@id='rooms']")
+    if rooms is None:
+        # eg redirected to the login page by a stale remember me cookie
+        raise RuntimeError(f"No rooms on dashboard for {user.email}. Login failed?")
+    return rooms.xpath(".//table/tbody/tr")
 
 
 def parse_row(row):
@@ -114,14 +160,14 @@ def parse_row(row):
                          ['typestr', 'description', 'link1', 'link2',
                           'appl_date', 'capacity', 'pos', 'del_link'])
 
-    row = RoomRow(*row.find_all('td'))
-    href = row.del_link.find("a").attrs["href"]
-    ext_room_id = int(href[href.rindex("/") + 1:])
+    row = RoomRow(*row.findall('td'))
+    # room id is the last path segment of the delete link
+    ext_room_id = int(row.del_link.find(".//a").get("href").rpartition("/")[2])
 
     return RoomRecord(
         None, ext_room_id, None,
-        row.typestr.text.strip(), row.description.text.strip(),
-        int(row.capacity.text.strip()), int(row.pos.text.strip()))
+        row.typestr.text_content().strip(), row.description.text_content().strip(),
+        int(row.capacity.text_content().strip()), int(row.pos.text_content().strip()))
 
 
 def get_db():
@@ -138,49 +184,54 @@ def get_db():
         sys.exit("Couldn't connect to db. Terminating.")
 
 
-def get_or_create_room_id(db, rec: RoomRecord, user: User):
-    """Retrieve room by ext_id or create a new one.
+def get_or_create_room_ids(db, recs: list[RoomRecord], user: User):
+    """Retrieve rooms by ext_id or create new ones, in one batch.
 
-    Sets an existing or new room_id on the RoomRecord passed in.
+    Sets an existing or new room_id on each RoomRecord passed in.
     """
     with db.cursor() as cur:
-        cur.execute("select id from room where ext_id = %s",
-                    (rec.ext_room_id,))
-        room_row = cur.fetchone()  # has unique index, so fetchone is safe
-        if room_row is not None:
-            rec.room_id = room_row[0]
-        else:
-            cur.execute(
-                "insert into room (user_id, ext_id, type, description) \
-                values (%s, %s, %s, %s)",
-                (user.id, rec.ext_room_id, rec.typestr, rec.description))
-            rec.room_id = cur.lastrowid
+        cur.execute("select ext_id, id from room where ext_id in %s",
+                    (tuple(rec.ext_room_id for rec in recs),))
+        room_ids = dict(cur.fetchall())
+
+        new_recs = [rec for rec in recs if rec.ext_room_id not in room_ids]
+        if new_recs:
+            # plain multi row insert, so constraint violations still raise
+            cur.executemany(
+                "insert into room (user_id, ext_id, type, description) "
+                "values (%s, %s, %s, %s)",
+                [(user.id, rec.ext_room_id, rec.typestr, rec.description) for rec in new_recs])
 
-        db.commit()
+            cur.execute("select ext_id, id from room where ext_id in %s",
+                        (tuple(rec.ext_room_id for rec in new_recs),))
+            room_ids.update(cur.fetchall())
 
+        for rec in recs:
+            rec.room_id = room_ids[rec.ext_room_id]
 
-def create_or_update_entry(db, rec: RoomRecord, user: User, update: bool):
-    """Create a new entry for a room, storing new queue position."""
-    with db.cursor() as cur:
-        cur.execute("set session transaction isolation level serializable")
 
-        cur.execute(
-            "select capacity, pos from entry "
-            "where room_id = %s and date = %s for update",
-            (rec.room_id, rec.date))
+def create_or_update_entries(db, recs: list[RoomRecord], user: User, update: bool):
+    """Create new entries for rooms, storing new queue positions, in one batch.
 
-        existing_row = cur.fetchone()  # has unique index
-        if existing_row is None:
-            cur.execute(
-                "insert into entry (date, room_id, capacity, pos) "
-                "values (%s, %s, %s, %s)",
-                (rec.date, rec.room_id, rec.capacity, rec.pos)
-            )
-        else:
+    All recs must be for the same date.
+    """
+    date = recs[0].date
+    with db.cursor() as cur:
+        # only for reporting. the upsert below is atomic on the unique (room_id, date) index,
+        # so no need for locking reads or serializable isolation
+        cur.execute(
+            "select room_id, capacity, pos from entry "
+            "where date = %s and room_id in %s",
+            (date, tuple(rec.room_id for rec in recs)))
+
+        existing_rows = {room_id: (capacity, pos) for room_id, capacity, pos in cur.fetchall()}
+        for rec in recs:
+            if rec.room_id not in existing_rows:
+                continue
             print(f"Found exsisting data for {user.email}, "
                   f"{abbrev_room(rec.typestr, rec.description)}, "
                   f"{rec.date.strftime('%d/%m/%Y')}: ", file=sys.stderr, end="")
-            existing_capacity, existing_pos = existing_row
+            existing_capacity, existing_pos = existing_rows[rec.room_id]
             if existing_capacity != rec.capacity or existing_pos != rec.pos:
                 if existing_capacity != rec.capacity:
                     print(f"capacity: {existing_capacity}->{rec.capacity} ")
@@ -188,93 +239,98 @@ def create_or_update_entry(db, rec: RoomRecord, user: User, update: bool):
                     print(f"pos: {existing_pos}->{rec.pos} ", file=sys.stderr, end="")
                 if update:
                     print('Updated.', file=sys.stderr)
-                    cur.execute(
-                        "update entry set capacity = %s, pos = %s "
-                        "where room_id = %s and date = %s",
-                        (rec.capacity, rec.pos, rec.room_id, rec.date)
-                    )
                 else:
                     print('Ignored, suggest --update. ', file=sys.stderr, end="")
             else:
                 print('Identical. ', file=sys.stderr, end="")
             print(file=sys.stderr)
 
-        db.commit()
-        cur.execute("set session transaction isolation level repeatable read")
+        # multi row insert. existing entries are only overwritten with --update
+        on_duplicate = "capacity = values(capacity), pos = values(pos)" if update else "pos = pos"
+        cur.executemany(
+            "insert into entry (date, room_id, capacity, pos) "
+            "values (%s, %s, %s, %s) "
+            "on duplicate key update " + on_duplicate,
+            [(rec.date, rec.room_id, rec.capacity, rec.pos) for rec in recs])
+
+
+ROOM_TYPES = {
+    'Wohngemeinschaft': 'WG',
+    'Einzelzimmer': 'EZ',
+    'Einzelapartment': 'EA'
+}
+DESCRIPTION_RE = re.compile(r'^([a-zäöüß]{2,5})[a-zäöüß\s]*([\d-]*)', re.I | re.U)
 
 
 def abbrev_room(type, description):
     """Make abbreviated description."""
-    types = {
-        'Wohngemeinschaft': 'WG',
-        'Einzelzimmer': 'EZ',
-        'Einzelapartment': 'EA'
-    }
     try:
         pos_open_bracket = description.rindex('(')
         descr = description[pos_open_bracket + 1:-1]
 
     except ValueError:
-        m = re.search(r'^([a-zäöüß]{2,5})[a-zäöüß\s]*([\d-]*)', description, re.I | re.U)
+        m = DESCRIPTION_RE.search(description)
         if m is None:
             # no match, fall back to basics
             descr = description[:10]
         else:
             descr = m.group(1) + ' ' + m.group(2)
 
-    descr = descr.ljust(11) + ' ' + types[type]
+    descr = descr.ljust(11) + ' ' + ROOM_TYPES[type]
     return descr
 
 
+def import_graph_modules():
+    """Import the slow modules needed for graphing, once. --scrape never needs them."""
+    global np, plt, matplotlib, pandas, ols_prefix
+    if np is None:
+        import numpy as np
+        import matplotlib
+        import matplotlib.pyplot as plt
+        import pandas
+        from _ols import ols_prefix
+
+
 def dates_to_ints(base: dt.date, dates: np.array):
     """Convert array of dates to array of ints = days since a base date."""
-    return np.array([int((date - base).days) for date in dates])
+    return (np.asarray(dates, dtype='datetime64[D]') - np.datetime64(base, 'D')).astype(np.int64)
 
 
-def regress(dates, positions, max_date, goal_date, delta_days=0):
-    """Regress with potential offset. dates must be sorted."""
-    at = max_date - dt.timedelta(days=delta_days)
-    bis = bisect.bisect_right(dates, at)
-    if bis == 0:
+def regress(x, y, k, min_date, step):
+    """Regress the first k points. x is int days since min_date."""
+    if k == 0:
         return None, None, None
 
-    min_date = dates[0]
-    dates_ltd = np.copy(dates)[:bis]
-    positions_ltd = np.copy(positions)[:bis]
-
-    # correct for large downwards step on Nov25. In future detect these automatically
-    bis_step = bisect.bisect_left(dates_ltd, dt.date(2023, 11, 25))
-    step = 0
-    if (bis_step != 0 and bis_step < len(dates_ltd) - 1):
-        step = positions_ltd[bis_step + 1] - positions_ltd[bis_step]
-        positions_ltd[bis_step + 1:] -= step
-
-    if len(dates_ltd) > 1:
-        fitdata = np.polyfit(dates_to_ints(min_date, dates_ltd),
-                             positions_ltd, deg=1, full=True)
-    else:
-        fitdata = ([0, positions_ltd[0]], [0], 0, [0, 0], 0)
-
-    polycoeffs, residuals, rank, singular_vs, rcond = fitdata
-    m, c = polycoeffs
-    # TODO: use residuals to detect steps, by looking 5 * stddev or similar
-    # print("stddev=", np.sqrt(residuals[0] / (len(dates_ltd) - rank)))
+    m, c = ols_prefix(x, y, k)
 
     # reattach linear regression to the points after the step
     c += step
 
-    # not using final position any more
-    # fpos = int(round(m * int((goal_date - min_date).days) + c))
     # project to goal_date
-    eta = min_date + dt.timedelta(days=int(round(-c / m))) if abs(m) > 1e-8 else None
+    eta = (min_date + np.timedelta64(int(round(-c / m)), 'D')).item() if abs(m) > 1e-8 else None
     return m, c, eta
 
 
 def compute_regression(dates, positions, max_date, goal_date):
-    """Compute regression line by converting to int days since min_date."""
-    m, c, eta = regress(dates, positions, max_date, goal_date)
-    _, _, eta_1d = regress(dates, positions, max_date, goal_date, delta_days=1)
-    _, _, eta_1w = regress(dates, positions, max_date, goal_date, delta_days=7)
+    """Compute regression lines for today, 1 day ago and 1 week ago. dates must be sorted."""
+    min_date = dates[0]
+    x = dates_to_ints(min_date, dates)
+    y = positions.astype(np.float64)
+
+    # correct for large downwards step on Nov25. In future detect these automatically
+    bis_step = np.searchsorted(dates, np.datetime64('2023-11-25'), side='left')
+    step = 0
+    if (bis_step != 0 and bis_step < len(dates) - 1):
+        step = y[bis_step + 1] - y[bis_step]
+        y[bis_step + 1:] -= step  # y is already our own float copy
+
+    fits = []
+    for delta_days in (0, 1, 7):
+        k = np.searchsorted(dates, max_date - np.timedelta64(delta_days, 'D'), side='right')
+        # the step only applies to fits which include points after it
+        fits.append(regress(x, y, k, min_date, step if bis_step < k - 1 else 0))
+
+    (m, c, eta), (_, _, eta_1d), (_, _, eta_1w) = fits
     deta_1d = int((eta - eta_1d).days) if eta is not None and eta_1d is not None else None
     deta_1w = int((eta - eta_1w).days) if eta is not None and eta_1w is not None else None
 
@@ -293,13 +349,13 @@ def format_delta_pos(dfpos: int | None, suffix: str):
     return s.rjust(6)
 
 
-def draw_room_line(rows: np.array, user: User,
+def draw_room_line(dates: np.array, positions: np.array, user: User,
                    type: str, description: str):
-    """Draw line and trend line for one one room."""
-    # lazy import, because slow
-    import matplotlib.pyplot as plt
-    dates, positions = rows[:, 0], rows[:, 1].astype('int')
-    min_date, max_date = dates[0], dates[-1]
+    """Draw line for one one room. dates are datetime64[D], positions int64.
+
+    Returns the regression and the line, for draw_trend_lines.
+    """
+    max_date = dates[-1]
 
     rl = compute_regression(dates, positions, max_date, user.goal_date)
 
@@ -310,20 +366,31 @@ def draw_room_line(rows: np.array, user: User,
         format_delta_pos(rl.deta_1w, "w")
 
     line, = plt.plot(dates, positions, label=label)
+    return rl, line
+
 
-    trend_dates = np.array([max_date, user.goal_date])
-    trend_days = dates_to_ints(min_date, trend_dates)
+def draw_trend_lines(trends, user: User, axes):
+    """Draw the regression lines of all rooms with one plot call, from last date to goal date.
 
-    plt.plot(trend_dates, rl.m * trend_days + rl.c, line.get_color(), linestyle=':')
-    return rl.eta
+    trends are (min_date, max_date, m, c, line) per room.
+    """
+    if not trends:
+        return
+
+    min_dates, max_dates, ms, cs, lines = zip(*trends)
+    trend_dates = np.stack([np.array(max_dates, dtype='datetime64[D]'),
+                            np.full(len(trends), user.goal_date, dtype='datetime64[D]')], axis=1)
+    trend_days = (trend_dates - np.array(min_dates, dtype='datetime64[D]')[:, None]).astype(np.int64)
+    trend_positions = np.array(ms)[:, None] * trend_days + np.array(cs)[:, None]
+
+    # each column is a separate line, coloured to match its room's line
+    trend_lines = axes.plot(trend_dates.T, trend_positions.T, linestyle=':')
+    for trend_line, line in zip(trend_lines, lines):
+        trend_line.set_color(line.get_color())
 
 
 def decorate_graph(user: User, legend_order, min_date, max_date, axes):
     """Factor out style and formatting steps for readability."""
-    # lazy import, because slow
-    import matplotlib.pyplot as plt
-    import matplotlib
-    import pandas
     """Decorate Graph with titles, legend and ticks."""
     # sort legend by final queue pos at goal date
     order = sorted(legend_order,
@@ -358,31 +425,40 @@ def decorate_graph(user: User, legend_order, min_date, max_date, axes):
 
 def draw_graph(db, date: dt.date, user: User, display):
     """Plot graph with projected trendlines."""
-    import matplotlib.pyplot as plt
+    import_graph_modules()
     _, ax = plt.subplots(figsize=(12, 8))
     LegendItem = namedtuple('LegendItem', ['eta', 'idx'])
     order = []
-    with db.cursor() as cur:
-        cur.execute("select id, type, description from room "
-                    "where user_id = %s order by id", (user.id,))
+    trends = []
+    # unbuffered cursor, so rows stream from the server as the rooms are drawn
+    with db.cursor(MySQLdb.cursors.SSCursor) as cur:
+        # entries for all rooms in one query, then split by room
+        cur.execute("select r.id, r.type, r.description, e.date, e.pos "
+                    "from room r join entry e on e.room_id = r.id "
+                    "where r.user_id = %s order by r.id, e.date", (user.id,))
+
+        rooms = groupby(cur, key=lambda row: row[:3])
+        for idx, ((room_id, type, description), entries) in enumerate(rooms):
+            entries = list(entries)
+
+            # fill typed arrays directly, rather than via an array of python objects
+            dates = np.empty(len(entries), dtype='datetime64[D]')
+            positions = np.empty(len(entries), dtype=np.int64)
+            for i, (*_, entry_date, pos) in enumerate(entries):
+                dates[i], positions[i] = entry_date, pos
+
+            rl, line = draw_room_line(dates, positions, user, type, description)
+            order.append(LegendItem(rl.eta, idx))
+            trends.append((dates[0], dates[-1], rl.m, rl.c, line))
 
-        for idx, (room_id, type, description) in enumerate(cur.fetchall()):
-            cur.execute("select date, pos "
-                        "from entry where room_id = %s order by date",
-                        (room_id,))
-
-            eta = draw_room_line(np.array(cur.fetchall()), user, type, description)
-            order.append(LegendItem(eta, idx))
-
-        cur.execute("select min(e.date) as min, max(e.date) as max "
-                    "from entry e join room r on e.room_id = r.id "
-                    "where r.user_id = %s",
-                    (user.id,))
-
-        overall_min_date, overall_max_date = cur.fetchone()
         db.commit()
 
-        decorate_graph(user, order, overall_min_date, overall_max_date, ax)
+    draw_trend_lines(trends, user, ax)
+
+    # overall date range from the rooms' first and last dates, rather than another query
+    overall_min_date = min(min_date for min_date, *_ in trends).item()
+    overall_max_date = max(max_date for _, max_date, *_ in trends).item()
+    decorate_graph(user, order, overall_min_date, overall_max_date, ax)
 
     if (display):
         plt.show()
@@ -392,14 +468,49 @@ def draw_graph(db, date: dt.date, user: User, display):
         print(filename)  # provide filename for calling program in shell
 
 
+def carry_forward_entries(db, date: dt.date, user: User):
+    """Copy the entries of the user's most recent scrape to date, if it is earlier."""
+    with db.cursor() as cur:
+        cur.execute(
+            "insert into entry (date, room_id, capacity, pos) "
+            "select %s, e.room_id, e.capacity, e.pos "
+            "from entry e join room r on e.room_id = r.id "
+            "where r.user_id = %s and e.date < %s and e.date = ("
+            "  select max(e2.date) from entry e2 join room r2 on e2.room_id = r2.id "
+            "  where r2.user_id = %s)",
+            (date, user.id, date, user.id))
+
+
+def save_dashboard_validators(db, user: User):
+    """Store the dashboard page's ETag and Last-Modified, for the next conditional request."""
+    with db.cursor() as cur:
+        cur.execute(
+            "update user set etag = %s, last_modified = %s "
+            "where id = %s",
+            (user.etag, user.last_modified, user.id))
+
+
 def scrape_queue_positions(db, date: dt.date, user: User, update: bool):
     """Scrape new queue positions off site for todays date."""
     rows = login_and_get_rows(db, user)
-    for row in rows:
-        rec = parse_row(row)
+    if rows is None:
+        # page unchanged, so are the queue positions
+        carry_forward_entries(db, date, user)
+        db.commit()
+        return
+
+    recs = [parse_row(row) for row in rows]
+    if not recs:
+        return
+
+    for rec in recs:
         rec.date = date
-        get_or_create_room_id(db, rec, user)
-        create_or_update_entry(db, rec, user, update)
+    # rooms and entries in one transaction, so one commit per user
+    get_or_create_room_ids(db, recs, user)
+    create_or_update_entries(db, recs, user, update)
+    # only with the entries, so a failed scrape isn't skipped as unchanged next time
+    save_dashboard_validators(db, user)
+    db.commit()
 
 
 def main():
@@ -427,7 +538,7 @@ def main():
 
     db = get_db()
     with db.cursor() as cur:
-        cur.execute("select id, email, password, rmc_value, rmc_expiry,"
+        cur.execute("select id, email, password, rmc_value, rmc_expiry, etag, last_modified, "
                     "firstname, lastname, goal_date "
                     "from user")
 